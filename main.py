@@ -2,16 +2,26 @@
 import os
 import re
 import csv
+import io
+import logging
 import asyncio
+import heapq
 import uuid
-from io import StringIO
-from typing import List, Dict, Optional, Tuple
+from collections import Counter
+from itertools import islice, count
+from bisect import bisect_left, insort
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple, Iterator, Iterable, BinaryIO
 from datetime import datetime, timezone, timedelta, date, time
 from zoneinfo import ZoneInfo
 
+import orjson
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import ORJSONResponse
 from aiogram import Bot, Dispatcher, types, Router, F
-from aiogram.filters import CommandStart, Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import CommandStart, Command, Filter
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton, Update,
     CallbackQuery, Message, FSInputFile
@@ -23,35 +33,84 @@ if not TOKEN:
     raise RuntimeError("Missing TELEGRAM_TOKEN environment variable")
 
 TZ = ZoneInfo("Europe/Paris")  # pour RDV & stats
-bot = Bot(token=TOKEN)
+
+# ----------------- Session HTTP Bot API -----------------
+class PooledAiohttpSession(AiohttpSession):
+    """Session aiohttp avec un pool plus large et un keep-alive long vers api.telegram.org.
+
+    Repose sur un interne d'aiogram 3.4.1 (`_connector_init`, kwargs du TCPConnector lus
+    par create_session) : version épinglée dans requirements.txt, à revérifier à chaque montée.
+    """
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        if not isinstance(getattr(self, "_connector_init", None), dict):
+            raise RuntimeError("AiohttpSession internals changed: update PooledAiohttpSession")
+        self._connector_init.update(limit=200, keepalive_timeout=75)
+
+bot = Bot(token=TOKEN, session=PooledAiohttpSession())
 dp = Dispatcher()
 router = Router()
 
 # ----------------- FastAPI -----------------
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.get("/")
 async def health():
     return {"status": "ok"}
 
+# File bornée des updates + pool fixe de workers (démarrés au startup)
+UPDATE_Q: "asyncio.Queue[Update]" = asyncio.Queue(maxsize=500)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+
+async def _update_worker() -> None:
+    while True:
+        update = await UPDATE_Q.get()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            # le webhook a déjà répondu 200 : on trace l'erreur au lieu de la perdre
+            logging.exception("update %s failed", update.update_id)
+        finally:
+            UPDATE_Q.task_done()
+
 @app.post("/telegram/webhook")
 async def telegram_webhook(request: Request):
     try:
-        data = await request.json()
+        data = orjson.loads(await request.body())
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
     try:
-        update = Update.model_validate(data)
+        # monté directement sur `bot` : évite à feed_update un dump + re-validate complet
+        update = Update.model_validate(data, context={"bot": bot})
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Bad Update: {e}")
-    await dp.feed_update(bot, update)
+    # répond 200 dès la mise en file (attend seulement si la file est pleine)
+    await UPDATE_Q.put(update)
     return {"ok": True}
 
 # ----------------- Mémoire (remplacer par DB plus tard) -----------------
-BASES: Dict[str, Dict] = {
-    "default": {"records": 0, "size_mb": 0.0, "last_import": None, "phone_count": 0,
-                "records_list": [], "dept_counts": {}}
-}
+def new_base() -> Dict:
+    """Métadonnées + stockage d'une base vide (seule source du gabarit)."""
+    return {"records": 0, "size_mb": 0.0, "last_import": None, "phone_count": 0,
+            "records_list": [], "records_by_rid": {}, "dept_counts": Counter(), "next_rid": 0}
+
+# Ajouts / suppressions de bases : passer par _add_base / _drop_base, qui appellent
+# _bases_changed() (sinon le clavier de la liste des bases en cache devient périmé).
+BASES: Dict[str, Dict] = {"default": new_base()}
+_BASES_GEN = 0  # incrémenté à chaque ajout / suppression de base (clé des menus en cache)
+
+def _bases_changed() -> None:
+    global _BASES_GEN
+    _BASES_GEN += 1
+
+def _add_base(name: str) -> None:
+    BASES[name] = new_base()
+    _bases_changed()
+
+def _drop_base(name: str) -> None:
+    del BASES[name]
+    _bases_changed()
+
 USER_PREFS: Dict[int, Dict] = {}
 USER_STATE: Dict[int, Dict] = {}
 # flags:
@@ -65,22 +124,29 @@ USER_STATE: Dict[int, Dict] = {}
 # Stats du jour par utilisateur
 USER_DAILY_STATS: Dict[int, Dict[str, Dict[str, int]]] = {}
 
-# Listes des fiches marquées
-USER_TREATED: Dict[int, Dict[str, List[str]]] = {}
-USER_MISSED: Dict[int, Dict[str, List[str]]] = {}
-USER_INPROGRESS: Dict[int, Dict[str, List[str]]] = {}
+# Listes des fiches marquées (dict rid -> None : ordre d'insertion + appartenance en O(1))
+USER_TREATED: Dict[int, Dict[str, Dict[str, None]]] = {}
+USER_MISSED: Dict[int, Dict[str, Dict[str, None]]] = {}
+USER_INPROGRESS: Dict[int, Dict[str, Dict[str, None]]] = {}
 
 # RDV: USER_RDV[user_id][base] = [{"id","rid","at_iso","remind_iso","sent","chat_id"}]
 USER_RDV: Dict[int, Dict[str, List[Dict]]] = {}
+# Nombre de RDV non encore rappelés par base (évite de reparcourir USER_RDV à chaque accueil)
+USER_RDV_PENDING: Dict[int, Dict[str, int]] = {}
 
 # Calleurs
 CALLERS: Dict[int, List[Dict]] = {}  # per-user list of {"id","name","active":bool}
+CALLERS_BY_ID: Dict[int, Dict[str, Dict]] = {}  # user -> cid -> même dict que dans CALLERS
+CALLER_ASSIGNED: Dict[int, Dict[str, set]] = {}  # user -> cid -> {(base, rid)} assignés en cours
 REC_ASSIGN: Dict[int, Dict[str, Dict[str, Dict]]] = {}  # user -> base -> rid -> {"caller_id","name","since_iso"}
 REC_LAST_CALLER: Dict[int, Dict[str, Dict[str, Dict]]] = {}  # user -> base -> rid -> {"caller_id","name","last_iso"}
 
 # Traités meta pour comptages du jour par calleur
 TREATED_META: Dict[int, Dict[str, Dict[str, Dict]]] = {}  # user -> base -> rid -> {"caller_id","at_iso"}
 
+# Compteurs du jour par calleur (tenus à jour à chaque assignation / fin d'appel)
+CALLER_DAILY: Dict[int, Dict[str, Dict[str, Dict]]] = {}  # user -> base -> cid -> {"date","ongoing","treated"}
+
 def ensure_user(user_id: int) -> None:
     USER_PREFS.setdefault(user_id, {"active_db": "default"})
     USER_STATE.setdefault(user_id, {})
@@ -89,23 +155,28 @@ def ensure_user(user_id: int) -> None:
     USER_MISSED.setdefault(user_id, {})
     USER_INPROGRESS.setdefault(user_id, {})
     USER_RDV.setdefault(user_id, {})
+    USER_RDV_PENDING.setdefault(user_id, {})
     CALLERS.setdefault(user_id, [])
+    CALLERS_BY_ID.setdefault(user_id, {})
+    CALLER_ASSIGNED.setdefault(user_id, {})
     REC_ASSIGN.setdefault(user_id, {})
     REC_LAST_CALLER.setdefault(user_id, {})
     TREATED_META.setdefault(user_id, {})
+    CALLER_DAILY.setdefault(user_id, {})
 
 def get_active_db(user_id: int) -> str:
     return USER_PREFS.get(user_id, {}).get("active_db", "default")
 
 def set_active_db(user_id: int, dbname: str) -> None:
     USER_PREFS.setdefault(user_id, {})["active_db"] = dbname
-    USER_TREATED[user_id].setdefault(dbname, [])
-    USER_MISSED[user_id].setdefault(dbname, [])
-    USER_INPROGRESS[user_id].setdefault(dbname, [])
+    USER_TREATED[user_id].setdefault(dbname, {})
+    USER_MISSED[user_id].setdefault(dbname, {})
+    USER_INPROGRESS[user_id].setdefault(dbname, {})
     USER_RDV[user_id].setdefault(dbname, [])
     REC_ASSIGN[user_id].setdefault(dbname, {})
     REC_LAST_CALLER[user_id].setdefault(dbname, {})
     TREATED_META[user_id].setdefault(dbname, {})
+    CALLER_DAILY[user_id].setdefault(dbname, {})
 
 def today_str() -> str:
     return datetime.now(TZ).date().isoformat()
@@ -124,6 +195,14 @@ def get_today_stats(user_id: int) -> Dict[str, int]:
         bucket.setdefault(k, 0)
     return bucket
 
+def pending_rdv_count(user_id: int, base: str) -> int:
+    return USER_RDV_PENDING.get(user_id, {}).get(base, 0)
+
+def _bump_rdv_pending(user_id: int, base: str, delta: int) -> None:
+    per_user = USER_RDV_PENDING.setdefault(user_id, {})
+    per_user[base] = per_user.get(base, 0) + delta
+    assert per_user[base] >= 0, ("rdv pending < 0", user_id, base)
+
 def inc_stat(user_id: int, key: str, delta: int = 1) -> None:
     if key not in ("treated", "missed", "cases"):
         return
@@ -142,13 +221,28 @@ async def delete_if_not_fiche(message: Message):
     except Exception:
         pass
 
+# Regex compilées une fois (import, recherche, saisies)
+_RE_NON_DIGIT = re.compile(r"\D")
+# supprime tout Latin-1 sauf 0-9 ; au-delà de U+00FF on retombe sur _RE_NON_DIGIT
+_NON_DIGIT_DEL = str.maketrans("", "", "".join(chr(c) for c in range(256) if not chr(c).isdecimal()))
+_RE_KV = re.compile(r"^\s*([A-Za-zÉÈÊËÀÂÄÔÖÎÏÛÜÇéèêëàâäôöîïûüç\s/.-]+)\s*:\s*(.+?)\s*$")
+_RE_IBAN = re.compile(r"^[A-Z]{2}\d{2}[A-Z0-9]{11,}$")
+_RE_CP = re.compile(r".*?\((\d{5})\)\s*$")
+_RE_NAME_SPLIT = re.compile(r"\s*[-/]\s*")
+_RE_PHONE10 = re.compile(r"0\d{9}")
+_RE_TIME_FR = re.compile(r"^(\d{1,2})h?[:]?(\d{2})?$")
+
 def normalize_phone(s: Optional[str]) -> Optional[str]:
     if not s:
         return None
     s = s.strip()
-    s = re.sub(r"^\s*\+33\s*", "0", s)
-    s = re.sub(r"^\s*0033\s*", "0", s)
-    digits = re.sub(r"\D", "", s)
+    if s.startswith("+33"):
+        s = "0" + s[3:].lstrip()
+    if s.startswith("0033"):
+        s = "0" + s[4:].lstrip()
+    digits = s.translate(_NON_DIGIT_DEL)
+    if not digits.isascii():
+        digits = _RE_NON_DIGIT.sub("", s)
     if digits.startswith("0") and len(digits) >= 10:
         digits = digits[:10]
         return digits if len(digits) == 10 else None
@@ -156,15 +250,35 @@ def normalize_phone(s: Optional[str]) -> Optional[str]:
         digits = "0" + digits
     return digits if len(digits) == 10 and digits.startswith("0") else None
 
+@lru_cache(maxsize=8192)
 def dept_from_cp(cp: Optional[str]) -> Optional[str]:
-    if not cp or not re.fullmatch(r"\d{5}", cp):
+    # isdecimal() == \d (chiffres Unicode) : même critère que l'ancien fullmatch(r"\d{5}")
+    if not cp or len(cp) != 5 or not cp.isdecimal():
         return None
     if cp.startswith(("97", "98")):
         return cp[:3]
     return cp[:2]
 
+def _is_iban(v: str) -> bool:
+    # pré-filtre longueur + 2 lettres ASCII avant la regex complète
+    return len(v) >= 15 and "A" <= v[0] <= "Z" and "A" <= v[1] <= "Z" and _RE_IBAN.match(v) is not None
+
+# préfixes de clé -> champ, dans l'ordre de priorité d'origine
+_KEY_PREFIXES = (("dob", "dob"), ("email", "email"), ("statut", "statut"), ("adresse", "adresse"),
+                 ("ville", "ville"), ("mobile", "mobile"), ("voip", "voip"), ("iban", "iban"), ("bic", "bic"))
+
+@lru_cache(maxsize=512)
+def _field_for_key(key: str) -> Optional[str]:
+    """Champ cible d'une clé « Clé : valeur » (mémoïsé : peu de clés distinctes par fichier)."""
+    if "naiss" in key:
+        return "dob"
+    for prefix, field in _KEY_PREFIXES:
+        if key.startswith(prefix):
+            return field
+    return None
+
 def parse_txt_block(block: str) -> Optional[Dict]:
-    lines = [l.strip() for l in block.splitlines() if l.strip()]
+    lines = [l for l in map(str.strip, block.splitlines()) if l]
     if not lines:
         return None
     data = {
@@ -175,70 +289,142 @@ def parse_txt_block(block: str) -> Optional[Dict]:
         "ville": None, "cp": None, "mobile": None, "voip": None,
         "notes": [], "next_rdv_iso": None
     }
-    re_kv = re.compile(r"^\s*([A-Za-zÉÈÊËÀÂÄÔÖÎÏÛÜÇéèêëàâäôöîïûüç\s/.-]+)\s*:\s*(.+?)\s*$")
-    re_iban = re.compile(r"^[A-Z]{2}\d{2}[A-Z0-9]{11,}$")
-    re_cp = re.compile(r".*?\((\d{5})\)\s*$")
-
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.upper().startswith("IBAN"):
-            m = re_kv.match(line)
-            if m:
-                v = m.group(2).strip().replace(" ", "")
-                if re_iban.match(v): data["iban"] = v
-            i += 1; continue
-        if line.upper().startswith("BIC"):
-            m = re_kv.match(line)
-            if m: data["bic"] = m.group(2).strip()
-            i += 1; continue
-        if ":" not in line:
-            data["full_name_raw"] = line
-            parts = re.split(r"\s*[-/]\s*", line, maxsplit=1)
-            if len(parts) == 2:
-                data["last_name"], data["first_name"] = parts[0].strip(), parts[1].strip()
-            else:
-                data["last_name"] = line.strip()
-            i += 1; break
-        i += 1
-
-    while i < len(lines):
-        line = lines[i]
-        m = re_kv.match(line)
+    # un seul parcours : en-tête (IBAN/BIC jusqu'à la ligne du nom), puis les « clé : valeur »
+    header = True
+    for line in lines:
+        if header:
+            head = line[:4].upper()
+            if head.startswith("IBAN"):
+                m = _RE_KV.match(line)
+                if m:
+                    v = m.group(2).strip().replace(" ", "")
+                    if _is_iban(v): data["iban"] = v
+            elif head.startswith("BIC"):
+                m = _RE_KV.match(line)
+                if m: data["bic"] = m.group(2).strip()
+            elif ":" not in line:
+                data["full_name_raw"] = line
+                parts = _RE_NAME_SPLIT.split(line, maxsplit=1)
+                if len(parts) == 2:
+                    data["last_name"], data["first_name"] = parts[0].strip(), parts[1].strip()
+                else:
+                    data["last_name"] = line.strip()
+                header = False
+            continue
+
+        m = _RE_KV.match(line)
         if m:
             key = m.group(1).strip().lower()
             val = m.group(2).strip()
             if val and val.upper() == "N/A": val = None
-            if key.startswith("dob") or "naiss" in key: data["dob"] = val
-            elif key.startswith("email"): data["email"] = val
-            elif key.startswith("statut"): data["statut"] = val
-            elif key.startswith("adresse"): data["adresse"] = val
-            elif key.startswith("ville"):
-                mcp = re_cp.match(val or "")
+            field = _field_for_key(key)
+            if field is None: pass
+            elif field == "ville":
+                mcp = _RE_CP.match(val or "")
                 if mcp:
                     data["cp"] = mcp.group(1)
                     data["ville"] = (val or "")[: (val or "").rfind("(")].strip()
                 else:
                     data["ville"] = val
-            elif key.startswith("mobile"): data["mobile"] = normalize_phone(val)
-            elif key.startswith("voip"): data["voip"] = normalize_phone(val)
-            elif key.startswith("iban") and not data["iban"]:
-                v = (val or "").replace(" ", "")
-                if re_iban.match(v): data["iban"] = v
-            elif key.startswith("bic") and not data["bic"]: data["bic"] = val
-        i += 1
+            elif field == "mobile" or field == "voip": data[field] = normalize_phone(val)
+            elif field == "iban":
+                if not data["iban"]:
+                    v = (val or "").replace(" ", "")
+                    if _is_iban(v): data["iban"] = v
+            elif field == "bic":
+                if not data["bic"]: data["bic"] = val
+            else: data[field] = val
 
     if not any([data["mobile"], data["voip"], data["email"], data["full_name_raw"], data["iban"]]):
         return None
     return data
 
-def parse_txt_blocks(content: str) -> List[Dict]:
-    blocks = re.split(r"(?:\r?\n){2,}", content)
-    results = []
-    for b in blocks:
-        rec = parse_txt_block(b)
-        if rec: results.append(rec)
-    return results
+def iter_txt_blocks(src: BinaryIO) -> Iterator[str]:
+    """Lit le fichier ligne à ligne et renvoie chaque bloc dès la ligne vide suivante."""
+    buf: List[str] = []
+    with io.TextIOWrapper(src, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            # séparateur = ligne réellement vide ; une ligne d'espaces reste dans la fiche
+            if line != "\n":
+                buf.append(line)
+            elif buf:
+                yield "".join(buf)
+                buf.clear()
+    if buf:
+        yield "".join(buf)
+
+RECORD_FIELDS = ("last_name", "first_name", "full_name_raw", "email", "mobile", "voip",
+                 "ville", "cp", "adresse", "iban", "bic", "dob", "statut")
+
+def record_from_mapping(row: Dict) -> Optional[Dict]:
+    """Fiche à partir d'une ligne JSON/CSV (mêmes colonnes que l'export)."""
+    if not isinstance(row, dict):
+        return None
+    data = {"rid": None, "notes": [], "next_rdv_iso": None}
+    for k in RECORD_FIELDS:
+        v = row.get(k)
+        v = str(v).strip() if v is not None else ""
+        data[k] = v if v and v.upper() != "N/A" else None
+    data["mobile"] = normalize_phone(data["mobile"])
+    data["voip"] = normalize_phone(data["voip"])
+    notes = row.get("notes")
+    if isinstance(notes, list):
+        data["notes"] = [str(n) for n in notes if n]
+    elif notes:
+        data["notes"] = [n for n in str(notes).split(" | ") if n]
+    if not any([data["mobile"], data["voip"], data["email"], data["full_name_raw"],
+                data["last_name"], data["first_name"], data["iban"]]):
+        return None
+    return data
+
+def iter_csv_records(src: BinaryIO) -> Iterator[Dict]:
+    with io.TextIOWrapper(src, encoding="utf-8-sig", errors="ignore", newline="") as f:
+        sample = f.read(65536)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        if reader.fieldnames:
+            reader.fieldnames = [(h or "").strip().lower() for h in reader.fieldnames]
+        for row in reader:
+            rec = record_from_mapping(row)
+            if rec:
+                yield rec
+
+def iter_jsonl_records(src: BinaryIO) -> Iterator[Dict]:
+    with src as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                rec = record_from_mapping(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                continue
+            if rec:
+                yield rec
+
+def iter_json_records(src: BinaryIO) -> Iterator[Dict]:
+    with src as f:
+        data = orjson.loads(f.read())
+    if isinstance(data, dict):
+        data = data.get("records", [data])
+    for row in data if isinstance(data, list) else []:
+        rec = record_from_mapping(row)
+        if rec:
+            yield rec
+
+def iter_txt_records(src: BinaryIO) -> Iterator[Dict]:
+    return filter(None, map(parse_txt_block, iter_txt_blocks(src)))
+
+# extension -> lecteur de fiches (chacun prend un flux binaire et le referme)
+IMPORT_PARSERS = {
+    "txt": iter_txt_records,
+    "csv": iter_csv_records,
+    "json": iter_json_records,
+    "jsonl": iter_jsonl_records,
+}
 
 # ----------------- Helpers callback & IDs -----------------
 async def safe_cb_answer(cb: CallbackQuery, text: Optional[str] = None):
@@ -247,6 +433,11 @@ async def safe_cb_answer(cb: CallbackQuery, text: Optional[str] = None):
     except Exception:
         pass
 
+def _parse_cb(data: Optional[str], n_fields: int) -> Optional[List[str]]:
+    """Découpe un callback_data « a:b:… » en n_fields champs ; None si le format ne colle pas."""
+    parts = (data or "").split(":", n_fields - 1)
+    return parts if len(parts) == n_fields else None
+
 def ensure_record_ids(base_name: str):
     base = BASES.get(base_name, {})
     lst = base.get("records_list", [])
@@ -257,6 +448,15 @@ def ensure_record_ids(base_name: str):
 async def show_page(cb: CallbackQuery, text: str, kb: InlineKeyboardMarkup,
                     photo_url: Optional[str] = None, parse_mode: Optional[str] = None):
     await safe_cb_answer(cb)
+    # page texte -> page texte : édition sur place (1 appel API au lieu de delete + send)
+    if not photo_url and getattr(cb.message, "text", None) is not None and not msg_is_fiche(cb.message):
+        try:
+            await cb.message.edit_text(text=text, reply_markup=kb, parse_mode=parse_mode)
+            return
+        except TelegramBadRequest as e:
+            # même page redemandée : rien à faire ; sinon (message trop ancien…) on renvoie
+            if "message is not modified" in str(e):
+                return
     # on ne supprime pas les fiches ; on peut enlever la page précédente si ce n'est pas une fiche
     await delete_if_not_fiche(cb.message)
     if photo_url:
@@ -264,6 +464,11 @@ async def show_page(cb: CallbackQuery, text: str, kb: InlineKeyboardMarkup,
     else:
         await bot.send_message(cb.message.chat.id, text=text, reply_markup=kb, parse_mode=parse_mode)
 
+# ----------------- Claviers statiques (construits une seule fois) -----------------
+NAV_START_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Retour", callback_data="nav:start")]
+])
+
 # ----------------- Rendu fiche + clavier -----------------
 def pretty_name(rec: Dict) -> str:
     last = rec.get("last_name") or ""
@@ -360,34 +565,107 @@ async def refresh_record_view(cb: CallbackQuery, user_id: int, base: str, rec: D
     except Exception:
         await send_record_card(cb.message.chat.id, user_id, base, rec)
 
-def find_record(base: str, rid: str) -> Optional[Dict]:
+def records_index(base: str) -> Dict[str, Dict]:
+    """Index rid -> fiche de la base ; reconstruit à la volée s'il manque."""
     meta = BASES.get(base)
     if not meta:
-        return None
-    ensure_record_ids(base)
-    for r in meta.get("records_list", []):
-        if str(r.get("rid")) == str(rid):
-            return r
-    return None
+        return {}
+    idx = meta.get("records_by_rid")
+    if idx is None:
+        ensure_record_ids(base)
+        idx = {str(r["rid"]): r for r in meta.get("records_list", [])}
+        meta["records_by_rid"] = idx
+    return idx
+
+def find_record(base: str, rid: str) -> Optional[Dict]:
+    return records_index(base).get(str(rid))
 
 # ----------------- Accueil -----------------
+def _caller_daily(user_id: int, base: str, cid: str) -> Dict:
+    d = today_str()
+    per_base = CALLER_DAILY.setdefault(user_id, {}).setdefault(base, {})
+    bucket = per_base.get(cid)
+    if not bucket or bucket.get("date") != d:
+        bucket = per_base[cid] = {"date": d, "ongoing": 0, "treated": 0}
+    return bucket
+
+def _bump_caller_daily(user_id: int, base: str, cid: Optional[str], key: str, at_iso: str, delta: int) -> None:
+    if not cid or not is_today_iso(at_iso):
+        return
+    bucket = _caller_daily(user_id, base, cid)
+    bucket[key] += delta
+    assert bucket[key] >= 0, ("caller daily < 0", user_id, base, cid, key)
+
+def _assign_caller(user_id: int, base: str, rid: str, meta: Dict) -> None:
+    _release_caller(user_id, base, rid)
+    REC_ASSIGN[user_id].setdefault(base, {})[rid] = meta
+    CALLER_ASSIGNED[user_id].setdefault(meta["caller_id"], set()).add((base, rid))
+    _bump_caller_daily(user_id, base, meta.get("caller_id"), "ongoing", meta.get("since_iso", ""), +1)
+
+def _release_caller(user_id: int, base: str, rid: str) -> Optional[Dict]:
+    assign = REC_ASSIGN[user_id].get(base, {}).pop(rid, None)
+    if assign:
+        CALLER_ASSIGNED[user_id].get(assign.get("caller_id"), set()).discard((base, rid))
+        _bump_caller_daily(user_id, base, assign.get("caller_id"), "ongoing", assign.get("since_iso", ""), -1)
+    return assign
+
+def _set_treated_meta(user_id: int, base: str, rid: str, meta: Dict) -> None:
+    mapping = TREATED_META[user_id].setdefault(base, {})
+    old = mapping.get(rid)
+    if old:
+        _bump_caller_daily(user_id, base, old.get("caller_id"), "treated", old.get("at_iso", ""), -1)
+    mapping[rid] = meta
+    _bump_caller_daily(user_id, base, meta.get("caller_id"), "treated", meta.get("at_iso", ""), +1)
+
 def caller_counts(user_id: int, base: str, cid: str) -> Tuple[int, int]:
-    assign = REC_ASSIGN.get(user_id, {}).get(base, {})
-    ongoing_today = 0
-    for rid, meta in assign.items():
-        if meta.get("caller_id") == cid and is_today_iso(meta.get("since_iso", "")):
-            ongoing_today += 1
-    treated_meta = TREATED_META.get(user_id, {}).get(base, {})
-    treated_today = 0
-    for rid, meta in treated_meta.items():
-        if meta.get("caller_id") == cid and is_today_iso(meta.get("at_iso", "")):
-            treated_today += 1
-    return ongoing_today, treated_today
+    bucket = _caller_daily(user_id, base, cid)
+    return bucket["ongoing"], bucket["treated"]
+
+def get_caller(user_id: int, cid: Optional[str]) -> Optional[Dict]:
+    return CALLERS_BY_ID.get(user_id, {}).get(cid)
+
+def _add_caller(user_id: int, name: str) -> Dict:
+    c = {"id": uuid.uuid4().hex[:8], "name": name, "active": True}
+    CALLERS[user_id].append(c)
+    CALLERS_BY_ID[user_id][c["id"]] = c
+    return c
+
+def _remove_caller(user_id: int, cid: str) -> None:
+    if CALLERS_BY_ID[user_id].pop(cid, None):
+        CALLERS[user_id] = [c for c in CALLERS[user_id] if c["id"] != cid]
 
 def caller_counts_for_home(user_id: int, base: str) -> int:
     return len([c for c in CALLERS.get(user_id, []) if c.get("active", True)])
 
-async def send_home(chat_id: int, user_id: int):
+# Markups figés (pydantic frozen) : partagés entre utilisateurs, clé = compteurs affichés
+_HOME_KB_TOP = [
+    [InlineKeyboardButton(text="🗄️ Gérer les bases", callback_data="home:db")],
+    [InlineKeyboardButton(text="🔎 Rechercher une fiche", callback_data="home:search")],
+]
+
+@lru_cache(maxsize=512)
+def _home_kb(treated: int, inprogress: int, missed: int, rdv: int, callers: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=_HOME_KB_TOP + [
+        [InlineKeyboardButton(text=f"✅ Clients traités ({treated})", callback_data="home:treated")],
+        [InlineKeyboardButton(text=f"🗂️ Dossiers en cours ({inprogress})", callback_data="home:cases")],
+        [InlineKeyboardButton(text=f"📵 Appels manqués ({missed})", callback_data="home:missed")],
+        [InlineKeyboardButton(text=f"📅 RDV programmés ({rdv})", callback_data="home:rdv")],
+        [InlineKeyboardButton(text=f"👥 Gérer les calleurs ({callers})", callback_data="home:callers")],
+    ])
+
+HOME_PHOTO_URL = "https://i.postimg.cc/0jNN08J5/IMG-0294.jpg"
+_HOME_TEXT = (
+    "Base active : {}\n\n"
+    "Statistiques du jour :\n"
+    "- Clients traités : {}\n"
+    "- Appels manqués : {}\n"
+    "- Dossiers en cours : {}\n"
+    "- Fiches totales : {}\n\n"
+    "Utilisez les boutons ci-dessous ou tapez /start pour revenir à l'accueil."
+)
+
+def render_home(user_id: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Texte + clavier de l'accueil (partagé par /start et le bouton Retour)."""
     active_db = get_active_db(user_id)
     stats = get_today_stats(user_id)
     nb_contactes = stats.get("treated", 0)
@@ -395,34 +673,19 @@ async def send_home(chat_id: int, user_id: int):
     nb_dossiers_en_cours_day = stats.get("cases", 0)
     nb_fiches = BASES.get(active_db, {}).get("records", 0)
 
-    treated_count = len(USER_TREATED.get(user_id, {}).get(active_db, []))
-    inprogress_count = len(USER_INPROGRESS.get(user_id, {}).get(active_db, []))
-    missed_count = len(USER_MISSED.get(user_id, {}).get(active_db, []))
-    rdv_count = len([r for r in USER_RDV.get(user_id, {}).get(active_db, []) if not r.get("sent") and datetime.fromisoformat(r["at_iso"]) >= datetime.now(TZ)])
+    treated_count = len(USER_TREATED.get(user_id, {}).get(active_db, {}))
+    inprogress_count = len(USER_INPROGRESS.get(user_id, {}).get(active_db, {}))
+    missed_count = len(USER_MISSED.get(user_id, {}).get(active_db, {}))
+    rdv_count = pending_rdv_count(user_id, active_db)
     callers_count = caller_counts_for_home(user_id, active_db)
 
-    text = (
-        f"Base active : {active_db}\n\n"
-        "Statistiques du jour :\n"
-        f"- Clients traités : {nb_contactes}\n"
-        f"- Appels manqués : {nb_appels_manques_day}\n"
-        f"- Dossiers en cours : {nb_dossiers_en_cours_day}\n"
-        f"- Fiches totales : {nb_fiches}\n\n"
-        "Utilisez les boutons ci-dessous ou tapez /start pour revenir à l'accueil."
-    )
+    text = _HOME_TEXT.format(active_db, nb_contactes, nb_appels_manques_day,
+                             nb_dossiers_en_cours_day, nb_fiches)
+    return text, _home_kb(treated_count, inprogress_count, missed_count, rdv_count, callers_count)
 
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗄️ Gérer les bases", callback_data="home:db")],
-        [InlineKeyboardButton(text="🔎 Rechercher une fiche", callback_data="home:search")],
-        [InlineKeyboardButton(text=f"✅ Clients traités ({treated_count})", callback_data="home:treated")],
-        [InlineKeyboardButton(text=f"🗂️ Dossiers en cours ({inprogress_count})", callback_data="home:cases")],
-        [InlineKeyboardButton(text=f"📵 Appels manqués ({missed_count})", callback_data="home:missed")],
-        [InlineKeyboardButton(text=f"📅 RDV programmés ({rdv_count})", callback_data="home:rdv")],
-        [InlineKeyboardButton(text=f"👥 Gérer les calleurs ({callers_count})", callback_data="home:callers")],
-    ])
-
-    image_url = "https://i.postimg.cc/0jNN08J5/IMG-0294.jpg"
-    await bot.send_photo(chat_id=chat_id, photo=image_url, caption=text, reply_markup=kb)
+async def send_home(chat_id: int, user_id: int):
+    text, kb = render_home(user_id)
+    await bot.send_photo(chat_id=chat_id, photo=HOME_PHOTO_URL, caption=text, reply_markup=kb)
 
 @router.message(CommandStart())
 async def accueil(message: types.Message):
@@ -443,10 +706,7 @@ async def start_search(cb: CallbackQuery):
         "Envoie un numéro au format 06123456789.\n"
         "Je cherche dans la base active et j’affiche la fiche si elle existe."
     )
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Retour", callback_data="nav:start")]
-    ])
-    await show_page(cb, text, kb)
+    await show_page(cb, text, NAV_START_KB)
 
 # ----------------- /num : recherche par numéro (commande) -----------------
 async def find_and_reply_number(message: Message, raw_number: str):
@@ -455,7 +715,7 @@ async def find_and_reply_number(message: Message, raw_number: str):
     active = get_active_db(user_id)
 
     num = normalize_phone(raw_number.strip())
-    if not num or not re.fullmatch(r"0\d{9}", num):
+    if not num or not _RE_PHONE10.fullmatch(num):
         await bot.send_message(message.chat.id, "Numéro invalide. Exemple attendu : 06123456789")
         return
 
@@ -497,10 +757,10 @@ async def search_by_number_cmd(message: Message):
 @router.callback_query(F.data.startswith("rec:view:"))
 async def rec_view(cb: CallbackQuery):
     # rec:view:<base>:<rid>
-    try:
-        _, _, base, rid = cb.data.split(":", 3)
-    except Exception:
+    parts = _parse_cb(cb.data, 4)
+    if not parts:
         return await safe_cb_answer(cb)
+    _, _, base, rid = parts
     user_id = cb.from_user.id
     rec = find_record(base, rid)
     if not rec:
@@ -512,14 +772,22 @@ async def rec_view(cb: CallbackQuery):
 def render_db_list_text_only() -> str:
     return "Gérer les bases\n\nSélectionnez une base ci-dessous, ou ajoutez-en une nouvelle."
 
+_DB_LIST_FOOTER = (
+    [InlineKeyboardButton(text="➕ Ajouter une base", callback_data="db:create")],
+    [InlineKeyboardButton(text="Retour", callback_data="nav:start")],
+)
+
 def db_list_keyboard(user_id: int) -> InlineKeyboardMarkup:
-    active = get_active_db(user_id)
+    return _db_list_kb(_BASES_GEN, get_active_db(user_id))
+
+@lru_cache(maxsize=64)
+def _db_list_kb(gen: int, active: str) -> InlineKeyboardMarkup:
+    # `gen` ne sert que de clé : il change dès que la liste des bases change
     rows = []
-    for name in BASES.keys():
+    for name in BASES:
         label = f"{'●' if name == active else '○'} {name}"
         rows.append([InlineKeyboardButton(text=label, callback_data=f"db:open:{name}")])
-    rows.append([InlineKeyboardButton(text="➕ Ajouter une base", callback_data="db:create")])
-    rows.append([InlineKeyboardButton(text="Retour", callback_data="nav:start")])
+    rows.extend(_DB_LIST_FOOTER)
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 @router.callback_query(F.data == "home:db")
@@ -531,7 +799,9 @@ async def open_db_list(cb: CallbackQuery):
     await show_page(cb, text, kb)
 
 # ----------------- Menu d'une base -----------------
+@lru_cache(maxsize=128)
 def base_menu_keyboard(name: str) -> InlineKeyboardMarkup:
+    # ne dépend que du nom : une base supprimée puis recréée retrouve le même menu
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📥 Importer (.txt/.csv/.jsonl)", callback_data=f"db:import:{name}")],
         [InlineKeyboardButton(text="📊 Statistiques (départements)", callback_data=f"db:stats:{name}")],
@@ -555,7 +825,7 @@ async def db_open(cb: CallbackQuery):
 # ----------------- Saisies texte : nom / recherche / note / rdv / calleur -----------------
 def parse_time_fr(s: str) -> Optional[Tuple[int, int]]:
     s = (s or "").strip().lower().replace(" ", "")
-    m = re.match(r"^(\d{1,2})h?[:]?(\d{2})?$", s)
+    m = _RE_TIME_FR.match(s)
     if not m:
         return None
     hh = int(m.group(1))
@@ -564,7 +834,20 @@ def parse_time_fr(s: str) -> Optional[Tuple[int, int]]:
         return None
     return hh, mm
 
-@router.message(F.text)
+# états USER_STATE qui attendent une saisie texte (traités par capture_text)
+_TEXT_INPUT_STATES = ("awaiting_caller_name", "awaiting_note_for", "awaiting_rdv_for",
+                      "awaiting_base_name", "awaiting_search_number")
+
+class AwaitingState(Filter):
+    """Ne laisse passer le message que si l'un des états USER_STATE donnés est actif."""
+    def __init__(self, *keys: str) -> None:
+        self.keys = keys
+
+    async def __call__(self, message: Message) -> bool:
+        state = USER_STATE.get(message.from_user.id)
+        return bool(state) and any(state.get(k) for k in self.keys)
+
+@router.message(F.text, AwaitingState(*_TEXT_INPUT_STATES))
 async def capture_text(message: Message):
     user_id = message.from_user.id
     ensure_user(user_id)
@@ -576,7 +859,7 @@ async def capture_text(message: Message):
         if not raw or len(raw) > 40:
             await bot.send_message(message.chat.id, "Nom invalide (1–40 caractères).")
             return
-        CALLERS[user_id].append({"id": uuid.uuid4().hex[:8], "name": raw, "active": True})
+        _add_caller(user_id, raw)
         # message persistant (ne s'auto-supprime pas)
         await bot.send_message(message.chat.id, f"👤 Calleur « {raw} » ajouté.")
         # revenir au menu des calleurs
@@ -615,13 +898,7 @@ async def capture_text(message: Message):
         at = now.replace(hour=h, minute=m, second=0, microsecond=0)
         if at <= now:
             at = at + timedelta(days=1)
-        remind = at - timedelta(minutes=5)
-        rdv_id = uuid.uuid4().hex
-        USER_RDV[user_id].setdefault(base, []).append({
-            "id": rdv_id, "rid": rid,
-            "at_iso": at.isoformat(), "remind_iso": remind.isoformat(),
-            "sent": False, "chat_id": message.chat.id
-        })
+        _add_rdv(user_id, base, _new_rdv_item(rid, at, message.chat.id))
         rec = find_record(base, rid)
         if rec:
             rec["next_rdv_iso"] = at.isoformat()
@@ -634,15 +911,15 @@ async def capture_text(message: Message):
     # ---- Création base : on attend un nom
     if USER_STATE[user_id].get("awaiting_base_name"):
         raw = (message.text or "").strip()
-        if not re.fullmatch(r"[A-Za-z0-9_]{1,40}", raw):
+        # [A-Za-z0-9_]{1,40} sans regex ("_" remplacé pour que "___" reste valide)
+        if not (len(raw) <= 40 and raw.isascii() and raw.replace("_", "a").isalnum()):
             await bot.send_message(message.chat.id, "Nom invalide. Autorisés: A–Z, a–z, 0–9, _. Max 40.")
             return
         if raw in BASES:
             await bot.send_message(message.chat.id, "Ce nom existe déjà. Choisissez-en un autre.")
             return
 
-        BASES[raw] = {"records": 0, "size_mb": 0.0, "last_import": None, "phone_count": 0,
-                      "records_list": [], "dept_counts": {}}
+        _add_base(raw)
         USER_STATE[user_id]["awaiting_base_name"] = False
         set_active_db(user_id, raw)
 
@@ -697,10 +974,8 @@ async def db_stats(cb: CallbackQuery):
     total = meta["records"]
     depts = sorted_dept_counts(meta.get("dept_counts", {}))
     if depts:
-        lines = [f"Statistiques — {name}", "", f"Total fiches : {total}", ""]
-        for code, n in depts:
-            lines.append(f"- {code} : {n} fiche(s)")
-        text = "\n".join(lines)
+        text = (f"Statistiques — {name}\n\nTotal fiches : {total}\n\n"
+                + "\n".join([f"- {code} : {n} fiche(s)" for code, n in depts]))
     else:
         text = f"Statistiques — {name}\n\nTotal fiches : {total}\n\nAucun département détecté."
 
@@ -731,7 +1006,40 @@ async def db_import_start(cb: CallbackQuery):
     ])
     await show_page(cb, text, kb)
 
-@router.message(F.document)
+IMPORT_BATCH = 1000
+IMPORT_MEM_MAX = 32 << 20  # au-delà, le fichier est téléchargé sur disque plutôt qu'en mémoire
+
+def _batched(items: Iterable[Dict], n: int) -> Iterator[List[Dict]]:
+    batch = []
+    for it in items:
+        batch.append(it)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _append_records(target: str, batch: List[Dict]) -> int:
+    """Ajoute un lot de fiches parsées à la base ; renvoie le nombre de numéros ajoutés."""
+    meta = BASES[target]
+    nxt = meta.setdefault("next_rid", len(meta["records_list"]))
+    depts = [dept_from_cp(r.get("cp")) for r in batch]
+    phones = 0
+    for r, dept in zip(batch, depts):
+        r["dept"] = dept
+        r.setdefault("notes", [])
+        r.setdefault("next_rdv_iso", None)
+        r["rid"] = str(nxt)
+        nxt += 1
+        if r.get("mobile"): phones += 1
+        if r.get("voip"): phones += 1
+    meta["next_rid"] = nxt
+    meta["dept_counts"].update(filter(None, depts))
+    meta["records_list"].extend(batch)
+    records_index(target).update((r["rid"], r) for r in batch)
+    return phones
+
+@router.message(F.document, AwaitingState("awaiting_import_for_base"))
 async def handle_import_file(message: Message):
     user_id = message.from_user.id
     ensure_user(user_id)
@@ -740,48 +1048,47 @@ async def handle_import_file(message: Message):
         return
 
     filename = message.document.file_name or ""
-    allowed = (filename.endswith(".csv") or filename.endswith(".json")
-               or filename.endswith(".jsonl") or filename.endswith(".txt"))
-    if not allowed:
+    read_records = IMPORT_PARSERS.get(os.path.splitext(filename)[1].lower().lstrip("."))
+    if not read_records:
         await bot.send_message(message.chat.id, "Format non pris en charge. Envoie .csv, .json, .jsonl ou .txt.")
         return
 
+    # en mémoire pour les fichiers courants ; les très gros transitent par /tmp
     tg_file = await bot.get_file(message.document.file_id)
-    dst_path = f"/tmp/{message.document.file_unique_id}_{filename}"
-    await bot.download(tg_file, destination=dst_path)
+    file_size = message.document.file_size or tg_file.file_size or 0
+    spill_path = None
+    if file_size >= IMPORT_MEM_MAX:
+        spill_path = f"/tmp/{message.document.file_unique_id}_{filename}"
+        await bot.download(tg_file, destination=spill_path)
+        src = open(spill_path, "rb")
+    else:
+        src = io.BytesIO()
+        await bot.download(tg_file, destination=src)
+        src.seek(0)
+        file_size = file_size or src.getbuffer().nbytes
 
     added_records = 0
     added_phone_count = 0
-    size_mb = round((os.path.getsize(dst_path) / (1024 * 1024)), 2)
+    size_mb = round((file_size / (1024 * 1024)), 2)
 
     try:
-        if filename.endswith(".txt"):
-            with open(dst_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-            records = parse_txt_blocks(content)
-
-            for r in records:
-                dept = dept_from_cp(r.get("cp"))
-                r["dept"] = dept
-                r.setdefault("notes", [])
-                r.setdefault("next_rdv_iso", None)
-                r["rid"] = str(len(BASES[target]["records_list"]))
-                BASES[target]["records_list"].append(r)
-                added_records += 1
-                if r.get("mobile"): added_phone_count += 1
-                if r.get("voip"): added_phone_count += 1
-                if dept:
-                    BASES[target]["dept_counts"][dept] = BASES[target]["dept_counts"].get(dept, 0) + 1
-
-        elif filename.endswith(".csv"):
-            pass
-        elif filename.endswith(".jsonl") or filename.endswith(".json"):
-            pass
-
+        # lecture + parsing dans un thread (les lecteurs sont paresseux) ; BASES n'est modifié que sur l'event loop
+        records = await asyncio.to_thread(list, read_records(src))
+        for batch in _batched(records, IMPORT_BATCH):
+            added_phone_count += _append_records(target, batch)
+            added_records += len(batch)
+            await asyncio.sleep(0)
     except Exception as e:
         USER_STATE[user_id]["awaiting_import_for_base"] = None
         await bot.send_message(message.chat.id, f"Erreur pendant l'import: {e}")
         return
+    finally:
+        src.close()
+        if spill_path:
+            try:
+                os.unlink(spill_path)
+            except OSError:
+                pass
 
     BASES[target]["records"] += added_records
     BASES[target]["phone_count"] = BASES[target].get("phone_count", 0) + added_phone_count
@@ -802,6 +1109,23 @@ async def handle_import_file(message: Message):
     await bot.send_message(message.chat.id, text, reply_markup=kb)
 
 # ----------------- Export CSV -----------------
+# colonnes de l'export CSV (relues telles quelles par l'import CSV/JSON)
+_HEADERS = ("rid", "last_name", "first_name", "full_name_raw", "email", "mobile", "voip",
+            "ville", "cp", "dept", "adresse", "iban", "bic", "dob", "statut", "notes", "next_rdv_iso")
+
+def _write_export(path: str, records: List[Dict], headers: Tuple[str, ...]) -> None:
+    """Écrit le CSV directement sur disque, ligne par ligne (appelé hors event loop)."""
+    with open(path, "w", newline="", encoding="utf-8", buffering=1 << 20) as fh:
+        writer = csv.writer(fh)
+        writer.writerow(headers)
+        notes_col = headers.index("notes") if "notes" in headers else None
+        for rec in records:
+            # une seule liste par ligne, sans copie du dict ; les notes sont aplaties à la volée
+            row = [rec.get(h, "") for h in headers]
+            if notes_col is not None and isinstance(row[notes_col], list):
+                row[notes_col] = " | ".join(row[notes_col])
+            writer.writerow(row)
+
 @router.callback_query(F.data.startswith("db:export:"))
 async def db_export(cb: CallbackQuery):
     name = cb.data.split(":", 2)[2]
@@ -810,29 +1134,25 @@ async def db_export(cb: CallbackQuery):
         await safe_cb_answer(cb, "Base introuvable.")
         return
 
-    headers = ["rid", "last_name", "first_name", "full_name_raw", "email", "mobile", "voip",
-               "ville", "cp", "dept", "adresse", "iban", "bic", "dob", "statut", "notes", "next_rdv_iso"]
-    buf = StringIO()
-    writer = csv.DictWriter(buf, fieldnames=headers, extrasaction="ignore")
-    writer.writeheader()
-    for rec in meta.get("records_list", []):
-        row = dict(rec)
-        if isinstance(row.get("notes"), list):
-            row["notes"] = " | ".join(row["notes"])
-        writer.writerow(row)
-    csv_data = buf.getvalue().encode("utf-8")
-
+    # copie de la liste (pas des fiches) : un import concurrent peut l'allonger pendant l'écriture
+    rows = list(meta.get("records_list", []))
     tmp_path = f"/tmp/export_{name}_{int(datetime.now().timestamp())}.csv"
-    with open(tmp_path, "wb") as f:
-        f.write(csv_data)
+    await asyncio.to_thread(_write_export, tmp_path, rows, _HEADERS)
 
     await cb.message.answer_document(
         document=FSInputFile(tmp_path, filename=f"{name}.csv"),
-        caption=f"Export CSV — {name} ({len(meta.get('records_list', []))} fiches)."
+        caption=f"Export CSV — {name} ({len(rows)} fiches)."
     )
     await safe_cb_answer(cb)
 
 # ----------------- Supprimer (depuis le menu de la base) -----------------
+@lru_cache(maxsize=64)
+def _db_drop_kb(name: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Supprimer définitivement", callback_data=f"db:dropconfirm:{name}")],
+        [InlineKeyboardButton(text="Retour", callback_data=f"db:open:{name}")]
+    ])
+
 @router.callback_query(F.data.startswith("db:drop:"))
 async def db_drop(cb: CallbackQuery):
     user_id = cb.from_user.id
@@ -845,11 +1165,7 @@ async def db_drop(cb: CallbackQuery):
         return
 
     text = f"Confirmer la suppression de la base « {name} » ? Action définitive."
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Supprimer définitivement", callback_data=f"db:dropconfirm:{name}")],
-        [InlineKeyboardButton(text="Retour", callback_data=f"db:open:{name}")]
-    ])
-    await show_page(cb, text, kb)
+    await show_page(cb, text, _db_drop_kb(name))
 
 @router.callback_query(F.data.startswith("db:dropconfirm:"))
 async def db_drop_confirm(cb: CallbackQuery):
@@ -865,7 +1181,7 @@ async def db_drop_confirm(cb: CallbackQuery):
         await safe_cb_answer(cb, "Impossible: il doit rester au moins une base.")
         return
 
-    del BASES[name]
+    _drop_base(name)
     set_active_db(user_id, "default" if "default" in BASES else next(iter(BASES.keys())))
 
     text = render_db_list_text_only()
@@ -878,15 +1194,15 @@ def _exclusive_move(user_id: int, base: str, rid: str, target: str):
     lists = {"ongoing": USER_INPROGRESS, "treated": USER_TREATED, "missed": USER_MISSED}
     # retirer des autres
     for key, store in lists.items():
-        lst = store[user_id].setdefault(base, [])
+        lst = store[user_id].setdefault(base, {})
         if rid in lst and key != target:
-            lst.remove(rid)
+            del lst[rid]
             if key == "ongoing": inc_stat(user_id, "cases", -1)
             if key == "missed": inc_stat(user_id, "missed", -1)
     # ajouter dans la cible
-    dst = lists[target][user_id].setdefault(base, [])
+    dst = lists[target][user_id].setdefault(base, {})
     if rid not in dst:
-        dst.append(rid)
+        dst[rid] = None
         if target == "ongoing": inc_stat(user_id, "cases", +1)
         elif target == "treated": inc_stat(user_id, "treated", +1)
         elif target == "missed": inc_stat(user_id, "missed", +1)
@@ -894,10 +1210,10 @@ def _exclusive_move(user_id: int, base: str, rid: str, target: str):
 @router.callback_query(F.data.startswith("rec:ask:"))
 async def rec_ask(cb: CallbackQuery):
     # rec:ask:<action>:<base>:<rid>
-    try:
-        _, _, action, base, rid = cb.data.split(":", 4)
-    except Exception:
+    parts = _parse_cb(cb.data, 5)
+    if not parts:
         return await safe_cb_answer(cb)
+    _, _, action, base, rid = parts
     user_id = cb.from_user.id
     ensure_user(user_id)
     rec = find_record(base, rid)
@@ -914,13 +1230,10 @@ async def rec_ask(cb: CallbackQuery):
 
     if action == "rdv":
         # 7 prochains jours (fr)
-        wd_fr = ["Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim"]
-        start = datetime.now(TZ).date()
-        choices = [start + timedelta(days=i) for i in range(0, 7)]
         rows = [[InlineKeyboardButton(
-            text=f"{wd_fr[d.weekday()]} {d.strftime('%d/%m')}",
-            callback_data=f"rec:rdv_date:{base}:{rid}:{d.isoformat()}"
-        )] for d in choices]
+            text=label,
+            callback_data=f"rec:rdv_date:{base}:{rid}:{ds}"
+        )] for label, ds in rdv_date_choices(datetime.now(TZ).date())]
         rows.append([InlineKeyboardButton(text="Retour fiche", callback_data=f"rec:view:{base}:{rid}")])
         return await show_page(cb, "Choisis une date pour le RDV :", InlineKeyboardMarkup(inline_keyboard=rows))
 
@@ -957,16 +1270,17 @@ async def rec_ask(cb: CallbackQuery):
 
     if action == "finish":
         _exclusive_move(user_id, base, rid, "treated")
+        now_iso = datetime.now(TZ).isoformat()
         # conserver dernier calleur, retirer l'assign en cours
-        assign = REC_ASSIGN[user_id].get(base, {}).pop(rid, None)
+        assign = _release_caller(user_id, base, rid)
         if assign:
             REC_LAST_CALLER[user_id].setdefault(base, {})[rid] = {
-                "caller_id": assign["caller_id"], "name": assign["name"], "last_iso": datetime.now(TZ).isoformat()
+                "caller_id": assign["caller_id"], "name": assign["name"], "last_iso": now_iso
             }
-        TREATED_META[user_id].setdefault(base, {})[rid] = {
+        _set_treated_meta(user_id, base, rid, {
             "caller_id": (assign or REC_LAST_CALLER[user_id].get(base, {}).get(rid, {})).get("caller_id"),
-            "at_iso": datetime.now(TZ).isoformat()
-        }
+            "at_iso": now_iso
+        })
         await safe_cb_answer(cb, "🟢 Fin d’appel — classé en 'traités'.")
         rec2 = find_record(base, rid)
         if rec2:
@@ -976,7 +1290,7 @@ async def rec_ask(cb: CallbackQuery):
     if action == "missed":
         _exclusive_move(user_id, base, rid, "missed")
         # conserver dernier calleur, mais retirer l'assign en cours
-        assign = REC_ASSIGN[user_id].get(base, {}).pop(rid, None)
+        assign = _release_caller(user_id, base, rid)
         if assign:
             REC_LAST_CALLER[user_id].setdefault(base, {})[rid] = {
                 "caller_id": assign["caller_id"], "name": assign["name"], "last_iso": datetime.now(TZ).isoformat()
@@ -990,12 +1304,11 @@ async def rec_ask(cb: CallbackQuery):
 @router.callback_query(F.data.startswith("rec:do:"))
 async def rec_do(cb: CallbackQuery):
     # rec:do:<action>:<base>:<rid>[:caller_id]
-    parts = cb.data.split(":")
+    parts = (cb.data or "").split(":")
     user_id = cb.from_user.id
-    try:
-        _, _, action, base, rid = parts[:5]
-    except Exception:
+    if len(parts) < 5:
         return await safe_cb_answer(cb)
+    _, _, action, base, rid = parts[:5]
     ensure_user(user_id)
     set_active_db(user_id, base)
     rec = find_record(base, rid)
@@ -1004,37 +1317,58 @@ async def rec_do(cb: CallbackQuery):
 
     if action == "ongoing":
         caller_id = parts[5] if len(parts) > 5 else None
-        callers = CALLERS.get(user_id, [])
-        c = next((x for x in callers if x["id"] == caller_id), None)
+        c = get_caller(user_id, caller_id)
         if not c:
             return await safe_cb_answer(cb, "Calleur introuvable.")
         _exclusive_move(user_id, base, rid, "ongoing")
-        REC_ASSIGN[user_id].setdefault(base, {})[rid] = {
-            "caller_id": caller_id, "name": c["name"], "since_iso": datetime.now(TZ).isoformat()
-        }
+        now_iso = datetime.now(TZ).isoformat()
+        _assign_caller(user_id, base, rid, {
+            "caller_id": caller_id, "name": c["name"], "since_iso": now_iso
+        })
         REC_LAST_CALLER[user_id].setdefault(base, {})[rid] = {
-            "caller_id": caller_id, "name": c["name"], "last_iso": datetime.now(TZ).isoformat()
+            "caller_id": caller_id, "name": c["name"], "last_iso": now_iso
         }
         await safe_cb_answer(cb, f"📞 En ligne — {c['name']}")
         await refresh_record_view(cb, user_id, base, rec)
         return
 
 # ----------------- RDV (date -> time) + annulation confirm -----------------
+def _rdv_ts(it: Dict) -> float:
+    """Horodatage du RDV (epoch), mis en cache sur l'item au premier accès (0 si illisible)."""
+    ts = it.get("_at_ts")
+    if ts is None:
+        try:
+            ts = datetime.fromisoformat(it["at_iso"]).timestamp()
+        except Exception:
+            ts = 0.0
+        it["_at_ts"] = ts
+    return ts
+
+def _new_rdv_item(rid: str, at: datetime, chat_id: int) -> Dict:
+    """Item RDV : ISO pour l'affichage, epochs pré-calculés pour le tri et le scheduler."""
+    remind = at - timedelta(minutes=5)
+    return {
+        "id": uuid.uuid4().hex, "rid": rid,
+        "at_iso": at.isoformat(), "remind_iso": remind.isoformat(),
+        "_at_ts": at.timestamp(), "_remind_ts": remind.timestamp(),
+        "sent": False, "chat_id": chat_id,
+    }
+
+def _add_rdv(user_id: int, base: str, item: Dict) -> None:
+    # USER_RDV[user][base] reste trié par date de RDV
+    insort(USER_RDV[user_id].setdefault(base, []), item, key=_rdv_ts)
+    _bump_rdv_pending(user_id, base, +1)
+    _schedule_rdv_reminder(user_id, base, item)
+
 def get_upcoming_rdvs(user_id: int, base: str, rid: Optional[str] = None):
-    now = datetime.now(TZ)
+    lst = USER_RDV.get(user_id, {}).get(base, [])
     out = []
-    for it in USER_RDV.get(user_id, {}).get(base, []):
+    for it in islice(lst, bisect_left(lst, datetime.now(TZ).timestamp(), key=_rdv_ts), None):
         if it.get("sent"):
             continue
         if rid and it.get("rid") != rid:
             continue
-        try:
-            at = datetime.fromisoformat(it["at_iso"])
-        except Exception:
-            continue
-        if at >= now:
-            out.append((at, it))
-    out.sort(key=lambda x: x[0])
+        out.append((datetime.fromtimestamp(it["_at_ts"], TZ), it))
     return out
 
 def _refresh_record_next_rdv(user_id: int, base: str, rid: str):
@@ -1054,35 +1388,43 @@ def _cancel_rdv_by_id(user_id: int, base: str, rdv_id: str) -> Tuple[bool, Optio
     for it in lst:
         if it.get("id") == rdv_id and not it.get("sent"):
             cancelled = True
+            it["cancelled"] = True  # le scheduler l'ignorera en sortie de file
             target_rid = it.get("rid")
             continue
         kept.append(it)
     if cancelled:
         USER_RDV[user_id][base] = kept
+        _bump_rdv_pending(user_id, base, -1)
         if target_rid:
             _refresh_record_next_rdv(user_id, base, target_rid)
     return cancelled, target_rid
 
+WD_FR = ("Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim")
+
 def french_weekday(d: date) -> str:
-    return ["Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim"][d.weekday()]
+    return WD_FR[d.weekday()]
+
+@lru_cache(maxsize=2)
+def rdv_date_choices(start: date) -> Tuple[Tuple[str, str], ...]:
+    """(libellé, date ISO) des 7 jours à partir de start ; recalculé seulement au changement de jour."""
+    days = [start + timedelta(days=i) for i in range(7)]
+    return tuple((f"{french_weekday(d)} {d.strftime('%d/%m')}", d.isoformat()) for d in days)
 
 def round_up_to_next_halfhour(dt: datetime) -> datetime:
-    minute = 30 if dt.minute < 30 else 0
-    hour = dt.hour if dt.minute < 30 else (dt.hour + 1) % 24
-    day_add = 1 if (dt.minute >= 30 and dt.hour == 23) else 0
-    base = dt.replace(second=0, microsecond=0)
-    base = base.replace(hour=hour, minute=minute)
-    if day_add:
-        base = base + timedelta(days=1)
-    return base
+    # créneau strictement suivant : hh:00–hh:29 -> hh:30, hh:30–hh:59 -> (hh+1):00 (lendemain après 23:30)
+    step = (dt.minute // 30 + 1) * 30
+    return dt.replace(minute=0, second=0, microsecond=0) + timedelta(minutes=step)
 
 @router.callback_query(F.data.startswith("rec:rdv_date:"))
 async def rec_rdv_date(cb: CallbackQuery):
     # rec:rdv_date:<base>:<rid>:YYYY-MM-DD
+    parts = _parse_cb(cb.data, 5)
+    if not parts:
+        return await safe_cb_answer(cb)
+    _, _, base, rid, ds = parts
     try:
-        _, _, base, rid, ds = cb.data.split(":", 4)
         d = date.fromisoformat(ds)
-    except Exception:
+    except ValueError:
         return await safe_cb_answer(cb)
 
     now = datetime.now(TZ)
@@ -1111,28 +1453,36 @@ async def rec_rdv_date(cb: CallbackQuery):
     rows.append([InlineKeyboardButton(text="Retour dates", callback_data=f"rec:ask:rdv:{base}:{rid}")])
     await show_page(cb, f"Choisis une heure pour {french_weekday(d)} {d.strftime('%d/%m')} :", InlineKeyboardMarkup(inline_keyboard=rows))
 
+def _rdv_time_kb(base: str, rid: str, ds: str, hhmm: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✔️ Confirmer", callback_data=f"rec:rdv_create:{base}:{rid}:{ds}:{hhmm}")],
+        [InlineKeyboardButton(text="Retour heures", callback_data=f"rec:rdv_date:{base}:{rid}:{ds}")],
+        [InlineKeyboardButton(text="Retour fiche", callback_data=f"rec:view:{base}:{rid}")]
+    ])
+
 @router.callback_query(F.data.startswith("rec:rdv_time:"))
 async def rec_rdv_time(cb: CallbackQuery):
     # rec:rdv_time:<base>:<rid>:YYYY-MM-DD:HHMM
+    parts = _parse_cb(cb.data, 6)
+    if not parts:
+        return await safe_cb_answer(cb)
+    _, _, base, rid, ds, hhmm = parts
     try:
-        _, _, base, rid, ds, hhmm = cb.data.split(":", 5)
         d = date.fromisoformat(ds); h, m = int(hhmm[:2]), int(hhmm[2:])
-    except Exception:
+    except ValueError:
         return await safe_cb_answer(cb)
-    rows = [
-        [InlineKeyboardButton(text="✔️ Confirmer", callback_data=f"rec:rdv_create:{base}:{rid}:{ds}:{hhmm}")],
-        [InlineKeyboardButton(text="Retour heures", callback_data=f"rec:rdv_date:{base}:{rid}:{ds}")],
-        [InlineKeyboardButton(text="Retour fiche", callback_data=f"rec:view:{base}:{rid}")]
-    ]
-    await show_page(cb, f"Confirmer RDV le {french_weekday(d)} {d.strftime('%d/%m')} à {h:02d}:{m:02d} ?", InlineKeyboardMarkup(inline_keyboard=rows))
+    await show_page(cb, f"Confirmer RDV le {french_weekday(d)} {d.strftime('%d/%m')} à {h:02d}:{m:02d} ?", _rdv_time_kb(base, rid, ds, hhmm))
 
 @router.callback_query(F.data.startswith("rec:rdv_create:"))
 async def rec_rdv_create(cb: CallbackQuery):
     # rec:rdv_create:<base>:<rid>:YYYY-MM-DD:HHMM
+    parts = _parse_cb(cb.data, 6)
+    if not parts:
+        return await safe_cb_answer(cb)
+    _, _, base, rid, ds, hhmm = parts
     try:
-        _, _, base, rid, ds, hhmm = cb.data.split(":", 5)
         d = date.fromisoformat(ds); h, m = int(hhmm[:2]), int(hhmm[2:])
-    except Exception:
+    except ValueError:
         return await safe_cb_answer(cb)
     user_id = cb.from_user.id
     ensure_user(user_id)
@@ -1143,37 +1493,33 @@ async def rec_rdv_create(cb: CallbackQuery):
     at = datetime(d.year, d.month, d.day, h, m, tzinfo=TZ)
     if at <= datetime.now(TZ):
         at = at + timedelta(days=1)
-    remind = at - timedelta(minutes=5)
-    rdv_id = uuid.uuid4().hex
-    USER_RDV[user_id].setdefault(base, []).append({
-        "id": rdv_id, "rid": rid,
-        "at_iso": at.isoformat(), "remind_iso": remind.isoformat(),
-        "sent": False, "chat_id": cb.message.chat.id
-    })
+    _add_rdv(user_id, base, _new_rdv_item(rid, at, cb.message.chat.id))
     rec["next_rdv_iso"] = at.isoformat()
     await safe_cb_answer(cb, f"📅 RDV placé pour {format_dt_short(at)} (rappel 5 min avant).")
     await refresh_record_view(cb, user_id, base, rec)
 
+def _rdv_cancel_confirm_kb(base: str, rid: str, rdv_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🗑️ Oui, annuler", callback_data=f"rdv:do_cancel:{base}:{rid}:{rdv_id}")],
+        [InlineKeyboardButton(text="Retour liste RDV", callback_data=f"rec:ask:rdv_cancel:{base}:{rid}")]
+    ])
+
 @router.callback_query(F.data.startswith("rdv:confirm_cancel:"))
 async def rdv_confirm_cancel(cb: CallbackQuery):
     # rdv:confirm_cancel:<base>:<rid>:<rdv_id>
-    try:
-        _, _, base, rid, rdv_id = cb.data.split(":", 4)
-    except Exception:
+    parts = _parse_cb(cb.data, 5)
+    if not parts:
         return await safe_cb_answer(cb)
-    rows = [
-        [InlineKeyboardButton(text="🗑️ Oui, annuler", callback_data=f"rdv:do_cancel:{base}:{rid}:{rdv_id}")],
-        [InlineKeyboardButton(text="Retour liste RDV", callback_data=f"rec:ask:rdv_cancel:{base}:{rid}")]
-    ]
-    await show_page(cb, "Confirmer l’annulation de ce RDV ?", InlineKeyboardMarkup(inline_keyboard=rows))
+    _, _, base, rid, rdv_id = parts
+    await show_page(cb, "Confirmer l’annulation de ce RDV ?", _rdv_cancel_confirm_kb(base, rid, rdv_id))
 
 @router.callback_query(F.data.startswith("rdv:do_cancel:"))
 async def rdv_do_cancel(cb: CallbackQuery):
     # rdv:do_cancel:<base>:<rid>:<rdv_id>
-    try:
-        _, _, base, rid, rdv_id = cb.data.split(":", 4)
-    except Exception:
+    parts = _parse_cb(cb.data, 5)
+    if not parts:
         return await safe_cb_answer(cb)
+    _, _, base, rid, rdv_id = parts
     user_id = cb.from_user.id
     ok, _ = _cancel_rdv_by_id(user_id, base, rdv_id)
     await safe_cb_answer(cb, "🗑️ RDV annulé." if ok else "RDV introuvable ou déjà passé.")
@@ -1190,8 +1536,7 @@ async def list_rdv(cb: CallbackQuery):
     text = f"RDV programmés — base {base}\n\n"
     if not upcoming:
         text += "Aucun RDV à venir."
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Retour", callback_data="nav:start")]])
-        return await show_page(cb, text, kb)
+        return await show_page(cb, text, NAV_START_KB)
     rows = []
     for at, it in upcoming[:50]:
         rec = find_record(base, it["rid"])
@@ -1251,18 +1596,16 @@ async def home_callers_add(cb: CallbackQuery):
 async def home_callers_toggle(cb: CallbackQuery):
     user_id = cb.from_user.id
     cid = cb.data.split(":")[-1]
-    lst = CALLERS.get(user_id, [])
-    for c in lst:
-        if c["id"] == cid:
-            c["active"] = not c.get("active", True)
-            break
+    c = get_caller(user_id, cid)
+    if c:
+        c["active"] = not c.get("active", True)
     await home_callers(cb)
 
 @router.callback_query(F.data.startswith("home:callers:delask:"))
 async def home_callers_delask(cb: CallbackQuery):
     user_id = cb.from_user.id
     cid = cb.data.split(":")[-1]
-    c = next((x for x in CALLERS.get(user_id, []) if x["id"] == cid), None)
+    c = get_caller(user_id, cid)
     if not c:
         return await safe_cb_answer(cb, "Introuvable.")
     text = f"Supprimer le calleur « {c['name']} » ?"
@@ -1276,13 +1619,13 @@ async def home_callers_delask(cb: CallbackQuery):
 async def home_callers_del(cb: CallbackQuery):
     user_id = cb.from_user.id
     cid = cb.data.split(":")[-1]
-    lst = CALLERS.get(user_id, [])
-    CALLERS[user_id] = [c for c in lst if c["id"] != cid]
+    ensure_user(user_id)
+    _remove_caller(user_id, cid)
     # retirer ses assignations en cours
-    for base, mapping in REC_ASSIGN[user_id].items():
-        to_remove = [rid for rid, a in mapping.items() if a.get("caller_id") == cid]
-        for rid in to_remove:
-            mapping.pop(rid, None)
+    for base, rid in list(CALLER_ASSIGNED[user_id].pop(cid, ())):
+        _release_caller(user_id, base, rid)
+    for per_base in CALLER_DAILY.get(user_id, {}).values():
+        per_base.pop(cid, None)
     await home_callers(cb)
 
 @router.callback_query(F.data.startswith("home:callers:rename:"))
@@ -1290,11 +1633,11 @@ async def home_callers_rename(cb: CallbackQuery):
     user_id = cb.from_user.id
     ensure_user(user_id)
     cid = cb.data.split(":")[-1]
-    old = next((c for c in CALLERS[user_id] if c["id"] == cid), None)
+    old = get_caller(user_id, cid)
     if not old:
         return await safe_cb_answer(cb, "Introuvable.")
     # suppression de l'ancien puis demande du nouveau nom (flux léger)
-    CALLERS[user_id] = [c for c in CALLERS[user_id] if c["id"] != cid]
+    _remove_caller(user_id, cid)
     USER_STATE[user_id]["awaiting_caller_name"] = True
     text = f"Renommage — envoie le nouveau nom pour « {old['name']} » (ancien supprimé, nouveau créé)."
     kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Annuler", callback_data="home:callers")]])
@@ -1320,7 +1663,7 @@ async def callers_view(cb: CallbackQuery):
     user_id = cb.from_user.id
     base = get_active_db(user_id)
     cid = cb.data.split(":")[-1]
-    c = next((x for x in CALLERS.get(user_id, []) if x["id"] == cid), None)
+    c = get_caller(user_id, cid)
     if not c:
         return await safe_cb_answer(cb, "Calleur introuvable.")
     ongoing, treated_today = rec_ids_for_caller_all(user_id, base, cid)
@@ -1348,16 +1691,13 @@ async def callers_view(cb: CallbackQuery):
     await show_page(cb, "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=rows))
 
 # ----------------- Voir Clients traités / Dossiers en cours / Appels manqués -----------------
-async def show_records_list(cb: CallbackQuery, title: str, rec_ids: List[str], base: str):
+async def show_records_list(cb: CallbackQuery, title: str, rec_ids: Dict[str, None], base: str):
     if not rec_ids:
         text = f"Aucun {title.lower()} pour le moment."
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Retour", callback_data="nav:start")]
-        ])
-        return await show_page(cb, text, kb)
+        return await show_page(cb, text, NAV_START_KB)
 
     rows = []
-    for rid in rec_ids[:50]:
+    for rid in islice(rec_ids, 50):
         rec = find_record(base, rid)
         if not rec:
             continue
@@ -1376,7 +1716,7 @@ async def show_treated(cb: CallbackQuery):
     user_id = cb.from_user.id
     ensure_user(user_id)
     base = get_active_db(user_id)
-    rec_ids = USER_TREATED.get(user_id, {}).get(base, [])
+    rec_ids = USER_TREATED.get(user_id, {}).get(base, {})
     await show_records_list(cb, "Clients traités", rec_ids, base)
 
 @router.callback_query(F.data == "home:cases")
@@ -1384,7 +1724,7 @@ async def show_cases(cb: CallbackQuery):
     user_id = cb.from_user.id
     ensure_user(user_id)
     base = get_active_db(user_id)
-    rec_ids = USER_INPROGRESS.get(user_id, {}).get(base, [])
+    rec_ids = USER_INPROGRESS.get(user_id, {}).get(base, {})
     await show_records_list(cb, "Dossiers en cours", rec_ids, base)
 
 @router.callback_query(F.data == "home:missed")
@@ -1392,7 +1732,7 @@ async def show_missed(cb: CallbackQuery):
     user_id = cb.from_user.id
     ensure_user(user_id)
     base = get_active_db(user_id)
-    rec_ids = USER_MISSED.get(user_id, {}).get(base, [])
+    rec_ids = USER_MISSED.get(user_id, {}).get(base, {})
     await show_records_list(cb, "Appels manqués", rec_ids, base)
 
 # ----------------- Retour accueil -----------------
@@ -1401,73 +1741,87 @@ async def back_to_start(cb: CallbackQuery):
     ensure_user(cb.from_user.id)
     USER_STATE[cb.from_user.id]["awaiting_search_number"] = False
 
-    active_db = get_active_db(cb.from_user.id)
-    stats = get_today_stats(cb.from_user.id)
-    nb_contactes = stats.get("treated", 0)
-    nb_appels_manques_day = stats.get("missed", 0)
-    nb_dossiers_en_cours_day = stats.get("cases", 0)
-    nb_fiches = BASES.get(active_db, {}).get("records", 0)
+    text, kb = render_home(cb.from_user.id)
+    await show_page(cb, text, kb, photo_url=HOME_PHOTO_URL)
 
-    treated_count = len(USER_TREATED.get(cb.from_user.id, {}).get(active_db, []))
-    inprogress_count = len(USER_INPROGRESS.get(cb.from_user.id, {}).get(active_db, []))
-    missed_count = len(USER_MISSED.get(cb.from_user.id, {}).get(active_db, []))
-    rdv_count = len([r for r in USER_RDV.get(cb.from_user.id, {}).get(active_db, []) if not r.get("sent") and datetime.fromisoformat(r["at_iso"]) >= datetime.now(TZ)])
-    callers_count = caller_counts_for_home(cb.from_user.id, active_db)
+# ----------------- Scheduler RDV (rappel -5 min) -----------------
+# File de priorité des rappels : (remind_ts, seq, user_id, base, item). Les RDV annulés
+# restent dans le tas et sont ignorés à la sortie (flag "cancelled").
+_RDV_HEAP: List[Tuple[float, int, int, str, Dict]] = []
+_RDV_SEQ = count()
+_RDV_WAKEUP = asyncio.Event()
+
+def _schedule_rdv_reminder(user_id: int, base: str, it: Dict) -> None:
+    remind_ts = it.get("_remind_ts")
+    if remind_ts is None:
+        try:
+            remind_ts = datetime.fromisoformat(it["remind_iso"]).timestamp()
+        except Exception:
+            return
+    heapq.heappush(_RDV_HEAP, (remind_ts, next(_RDV_SEQ), user_id, base, it))
+    _RDV_WAKEUP.set()
 
-    text = (
-        f"Base active : {active_db}\n\n"
-        "Statistiques du jour :\n"
-        f"- Clients traités : {nb_contactes}\n"
-        f"- Appels manqués : {nb_appels_manques_day}\n"
-        f"- Dossiers en cours : {nb_dossiers_en_cours_day}\n"
-        f"- Fiches totales : {nb_fiches}\n\n"
-        "Utilisez les boutons ci-dessous ou tapez /start pour revenir à l'accueil."
-    )
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗄️ Gérer les bases", callback_data="home:db")],
-        [InlineKeyboardButton(text="🔎 Rechercher une fiche", callback_data="home:search")],
-        [InlineKeyboardButton(text=f"✅ Clients traités ({treated_count})", callback_data="home:treated")],
-        [InlineKeyboardButton(text=f"🗂️ Dossiers en cours ({inprogress_count})", callback_data="home:cases")],
-        [InlineKeyboardButton(text=f"📵 Appels manqués ({missed_count})", callback_data="home:missed")],
-        [InlineKeyboardButton(text=f"📅 RDV programmés ({rdv_count})", callback_data="home:rdv")],
-        [InlineKeyboardButton(text=f"👥 Gérer les calleurs ({callers_count})", callback_data="home:callers")],
-    ])
-    await show_page(cb, text, kb, photo_url="https://i.postimg.cc/0jNN08J5/IMG-0294.jpg")
+_RDV_SEND_SEM = asyncio.Semaphore(20)
+
+async def _send_rdv_reminder(user_id: int, base: str, it: Dict) -> None:
+    # réservé avant le premier await : une annulation concurrente (_cancel_rdv_by_id
+    # ignore les items "sent") ne peut plus décrémenter le compteur une 2e fois
+    if it.get("sent") or it.get("cancelled"):
+        return
+    it["sent"] = True
+    _bump_rdv_pending(user_id, base, -1)
+    rid = it["rid"]
+    rec = find_record(base, rid)
+    name = pretty_name(rec) if rec else f"Fiche {rid}"
+    at = datetime.fromisoformat(it["at_iso"]).astimezone(TZ).strftime("%H:%M")
+    try:
+        async with _RDV_SEND_SEM:
+            await bot.send_message(
+                chat_id=it["chat_id"],
+                text=f"⏰ Rappel RDV à {at} avec {name}",
+                reply_markup=InlineKeyboardMarkup(
+                    inline_keyboard=[[InlineKeyboardButton(text="Ouvrir la fiche", callback_data=f"rec:view:{base}:{rid}")]]
+                )
+            )
+    except Exception:
+        pass
 
-# ----------------- Scheduler RDV (rappel -5 min) -----------------
 async def rdv_scheduler():
     while True:
         try:
-            now = datetime.now(TZ)
-            for user_id, bases in list(USER_RDV.items()):
-                for base, items in list(bases.items()):
-                    for it in items:
-                        if it.get("sent"):
-                            continue
-                        try:
-                            remind_at = datetime.fromisoformat(it["remind_iso"])
-                        except Exception:
-                            continue
-                        if now >= remind_at:
-                            rid = it["rid"]
-                            rec = find_record(base, rid)
-                            name = pretty_name(rec) if rec else f"Fiche {rid}"
-                            at = datetime.fromisoformat(it["at_iso"]).astimezone(TZ).strftime("%H:%M")
-                            try:
-                                await bot.send_message(
-                                    chat_id=it["chat_id"],
-                                    text=f"⏰ Rappel RDV à {at} avec {name}",
-                                    reply_markup=InlineKeyboardMarkup(
-                                        inline_keyboard=[[InlineKeyboardButton(text="Ouvrir la fiche", callback_data=f"rec:view:{base}:{rid}")]]
-                                    )
-                                )
-                            except Exception:
-                                pass
-                            it["sent"] = True
-            await asyncio.sleep(30)
+            now_ts = datetime.now(TZ).timestamp()
+            due = []
+            while _RDV_HEAP and _RDV_HEAP[0][0] <= now_ts:
+                _, _, user_id, base, it = heapq.heappop(_RDV_HEAP)
+                if not (it.get("sent") or it.get("cancelled")):
+                    due.append(_send_rdv_reminder(user_id, base, it))
+            if due:
+                # envois en parallèle, plafonnés par _RDV_SEND_SEM (limite Telegram ~30 msg/s)
+                await asyncio.gather(*due, return_exceptions=True)
+                continue
+            # dort jusqu'au prochain rappel, ou jusqu'à ce qu'un RDV soit ajouté
+            _RDV_WAKEUP.clear()
+            timeout = _RDV_HEAP[0][0] - now_ts if _RDV_HEAP else None
+            try:
+                await asyncio.wait_for(_RDV_WAKEUP.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
         except Exception:
             await asyncio.sleep(30)
 
 @app.on_event("startup")
 async def on_startup():
     asyncio.create_task(rdv_scheduler())
+    for _ in range(UPDATE_WORKERS):
+        asyncio.create_task(_update_worker())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await bot.session.close()
+
+# ----------------- Lancement local -----------------
+# Équivalent : uvicorn main:app --loop uvloop --http httptools (fournis par uvicorn[standard])
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")),
+                loop="uvloop", http="httptools")